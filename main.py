@@ -1,21 +1,29 @@
 import argparse
+import asyncio
+import functools
+import hashlib
+import logging
+import random
 import re
+import sys
 import yaml
-import json
 import time
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional
 
 import ebooklib
+import orjson
+import tiktoken
 from ebooklib import epub
-from bs4 import BeautifulSoup
+from bs4 import UnicodeDammit
+from lxml import etree
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 
 # LlamaIndex imports
-from llama_index.core.llms import LLM
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.azure_openai import AzureOpenAI
-from llama_index.llms.gemini import Gemini
-from llama_index.llms.ollama import Ollama
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+
+logger = logging.getLogger(__name__)
 
 
 def read_config(config_file):
@@ -24,37 +32,103 @@ def read_config(config_file):
     return config
 
 
-def split_html_by_sentence(html_str, max_chunk_size=20000):
-    sentences = html_str.split(". ")
+# A chunk may end after a closing block-level tag, or after sentence
+# punctuation (plus closing quotes or brackets) followed by whitespace outside
+# a tag. Other tags are matched whole only so that punctuation inside their
+# attributes is skipped in a single pass instead of looking ahead from every
+# sentence end
+SENTENCE_END = re.compile(
+    r"</(?:p|div|h[1-6]|li|blockquote|section|table)>\s*"
+    r"|(?P<tag><[^<>]*>)"
+    r"|[.!?][\"'\u201d\u2019)]*\s+",
+    re.IGNORECASE,
+)
 
-    chunks = []
-    current_chunk = ""
 
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) > max_chunk_size:
-            chunks.append(current_chunk)
-            current_chunk = sentence
+def split_sentences(html_str):
+    # Boundaries are kept with the preceding sentence, so joining the
+    # sentences gives back the input unchanged
+    start = 0
+    for match in SENTENCE_END.finditer(html_str):
+        if match.group("tag"):
+            continue
+        yield html_str[start : match.end()]
+        start = match.end()
+    if start < len(html_str):
+        yield html_str[start:]
+
+
+@functools.lru_cache(maxsize=None)
+def token_encoding():
+    # Providers bill and limit by tokens; the GPT-4o encoding is a close
+    # enough estimate for the other supported models as well
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text):
+    return len(token_encoding().encode(text, disallowed_special=()))
+
+
+def split_html_by_sentence(html_str, max_chunk_size=20000, length=len):
+    # Short chapters (title pages, copyright notices) fit in one chunk, so
+    # there is no need to scan them for sentence boundaries
+    if length(html_str) <= max_chunk_size:
+        return [html_str] if html_str else []
+
+    sentences = [(sentence, length(sentence)) for sentence in split_sentences(html_str)]
+    remaining = sum(sentence_length for _, sentence_length in sentences)
+
+    def even_size(remaining):
+        # Aim for chunks of about the same size instead of filling each one up
+        # to the limit and leaving a short remainder for the last request
+        return remaining / max(1, -(-remaining // max_chunk_size))
+
+    chunks = []
+    # Sentences are collected in a list and joined once per chunk, as growing
+    # a string copies everything collected so far on each append
+    current_chunk = []
+    current_length = 0
+    target_size = even_size(remaining)
+
+    for sentence, sentence_length in sentences:
+        if current_chunk and (
+            current_length + sentence_length > max_chunk_size
+            or current_length + sentence_length / 2 > target_size
+        ):
+            chunks.append("".join(current_chunk))
+            remaining -= current_length
+            target_size = even_size(remaining)
+            current_chunk = [sentence]
+            current_length = sentence_length
         else:
-            current_chunk += ". "
-            current_chunk += sentence
+            current_chunk.append(sentence)
+            current_length += sentence_length
 
     if current_chunk:
-        chunks.append(current_chunk)
+        chunks.append("".join(current_chunk))
+
+    return chunks
 
-    # Remove dot from the beginning of first chunk
-    if chunks and chunks[0].startswith(". "):
-        chunks[0] = chunks[0][2:]
 
-    # Add dot to the end of each chunk
-    for i in range(len(chunks)):
-        if not chunks[i].endswith("."):
-            chunks[i] += "."
+MARKUP = re.compile(r"<[^>]*>|&#?\w+;")
+HEAD = re.compile(r"<head[\s>].*?(?:</head>|$)", re.IGNORECASE | re.DOTALL)
+
+
+def has_text(chunk):
+    # False for chunks with only markup, digits and punctuation (image pages,
+    # scene breaks), which have nothing for the LLM to translate. The <head>
+    # is left out, as nearly every chapter has a <title> even when its body
+    # has no text
+    return any(c.isalpha() for c in MARKUP.sub("", HEAD.sub("", chunk)))
 
-    return chunks
 
+BATCH_SEPARATOR = "\n%%\n"
+BATCH_SEPARATOR_RE = re.compile(r"\n[ \t]*%%[ \t]*\n")
 
-def system_prompt(from_lang: str, to_lang: str) -> str:
-    return (
+
+@functools.lru_cache(maxsize=None)
+def system_prompt(from_lang: str, to_lang: str, batched: bool = False) -> str:
+    prompt = (
         f"You are an {from_lang}-to-{to_lang} specialized translator. "
         f"Keep all special characters and HTML tags exactly as in the source text. "
         f"Your translation should be in {to_lang} only. "
@@ -62,94 +136,418 @@ def system_prompt(from_lang: str, to_lang: str) -> str:
         f"Maintain readability and consistency with the source text. "
         f"Do not add any explanations or comments, just provide the translation."
     )
+    if batched:
+        prompt += (
+            " The text consists of several segments separated by lines containing only %%. "
+            "Translate each segment on its own and keep the %% lines between them, "
+            "so the translation has exactly as many segments as the source text."
+        )
+    return prompt
+
+
+def error_status(error):
+    # HTTP status of a provider error, if its client library exposes one
+    response = getattr(error, "response", None)
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(response, "status_code", None),
+    ):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def retry_after(error):
+    # Seconds the provider asked to wait in its Retry-After header, if any
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return float(headers[name]) / scale
+        except (KeyError, TypeError, ValueError):
+            continue  # Missing, or an HTTP date rather than a number
+    return None
+
+
+def is_retryable(error):
+    # Timeouts, rate limits and server errors may pass on a retry; other
+    # client errors (bad request, wrong key, unknown model) never will
+    status = error_status(error)
+    return status is None or status in (408, 409, 429) or status >= 500
 
 
-def translate_chunk(
+async def translate_chunk(
     llm: LLM,
     text: str,
     from_lang: str = "EN",
     to_lang: str = "BG",
-    max_retries: int = 3,
+    max_retries: int = 6,
     retry_delay: int = 180,
+    batched: bool = False,
 ) -> str | None:
-    prompt = f"{system_prompt(from_lang, to_lang)}\n\nText to translate:\n{text}"
-
     for attempt in range(max_retries):
+        # The instructions go in their own system message, which is
+        # byte-identical for every chunk of a book, so providers with prompt
+        # prefix caching can reuse it instead of processing it again for each
+        # request. The messages are rebuilt for every attempt because some
+        # integrations (Gemini) merge the system message into the next one in
+        # place, which would send the prompt twice on a retry.
+        messages = [
+            ChatMessage(
+                role=MessageRole.SYSTEM,
+                content=system_prompt(from_lang, to_lang, batched),
+            ),
+            ChatMessage(role=MessageRole.USER, content=text),
+        ]
         try:
-            response = llm.complete(prompt)
-            return response.text.strip()
+            response = await llm.achat(messages)
+            return response.message.content.strip()
         except Exception as e:
-            if "rate limit" in str(e).lower() or "quota" in str(e).lower():
-                if attempt < max_retries - 1:
-                    print(
-                        f"Rate limit hit. Waiting {retry_delay} seconds before retry {attempt + 1}/{max_retries}"
-                    )
-                    time.sleep(retry_delay)
-                    continue
-            print(f"Error in translation attempt {attempt + 1}: {str(e)}")
-            if attempt == max_retries - 1:
+            logger.warning("Error in translation attempt %d: %s", attempt + 1, e)
+            if attempt == max_retries - 1 or not is_retryable(e):
                 raise
-            time.sleep(5)  # Short delay before retry
-
-
-def save_progress(progress_file, chapter, chunk_index, total_chunks):
-    with open(progress_file, "w") as f:
-        json.dump(
-            {
-                "chapter": chapter,
-                "chunk_index": chunk_index,
-                "total_chunks": total_chunks,
-                "timestamp": time.time(),
-            },
-            f,
+            # Wait as long as the provider asked; otherwise back off
+            # exponentially with jitter, doubling up to retry_delay before the
+            # last attempt: short hiccups are retried quickly, a rate limit
+            # still gets minutes to clear, and concurrent chunks hitting the
+            # same limit do not all retry at the same moment
+            delay = retry_after(e)
+            if delay is None:
+                delay = retry_delay / 2 ** (max_retries - 2 - attempt)
+                delay = min(retry_delay, delay * random.uniform(0.5, 1.5))
+            logger.info(
+                "Waiting %.0f seconds before retry %d/%d",
+                delay,
+                attempt + 1,
+                max_retries - 1,
+            )
+            await asyncio.sleep(delay)
+
+
+async def translate_batch(
+    llm: LLM,
+    chunks: list[str],
+    from_lang: str = "EN",
+    to_lang: str = "BG",
+) -> tuple[list[str], bool]:
+    # Several small chunks share one request, separated by %% lines; if the
+    # answer does not split back into as many segments, fall back to
+    # translating the chunks one by one. Also returns whether the batch
+    # prompt was used
+    if len(chunks) > 1:
+        translated = await translate_chunk(
+            llm, BATCH_SEPARATOR.join(chunks), from_lang, to_lang, batched=True
+        )
+        segments = BATCH_SEPARATOR_RE.split(translated)
+        if len(segments) == len(chunks):
+            return [segment.strip() for segment in segments], True
+        logger.warning(
+            "Batch of %d chunks came back as %d segments, translating them one by one",
+            len(chunks),
+            len(segments),
         )
+    translated = [
+        await translate_chunk(llm, chunk, from_lang, to_lang) for chunk in chunks
+    ]
+    return translated, False
+
+
+def open_journal(path):
+    # Journals stay open for the whole run rather than being reopened for
+    # every chunk; unbuffered, so each record reaches the file as it is written
+    journal = open(path, "ab", buffering=0)
+    if journal.tell() > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, 2)
+            if f.read() != b"\n":
+                # Start a new line after an old progress file or a record cut
+                # short by an interrupted write, so the next record stays
+                # readable
+                journal.write(b"\n")
+    return journal
+
+
+def source_hash(chunk, from_lang, to_lang):
+    return hashlib.sha256(f"{from_lang}|{to_lang}|{chunk}".encode()).hexdigest()
+
+
+def save_progress(journal, chapter, chunk_index, source, text, total_chunks):
+    # The progress file is an append-only journal with one line per translated
+    # chunk, so saving costs the same no matter how far the book has progressed.
+    # The hash of the source chunk ties the translation to the text it came
+    # from, so a progress file left by another book or language pair is not
+    # reused
+    record = {
+        "chapter": chapter,
+        "chunk_index": chunk_index,
+        "source": source,
+        "text": text,
+        "total_chunks": total_chunks,
+        "timestamp": time.time(),
+    }
+    journal.write(orjson.dumps(record) + b"\n")
 
 
 def load_progress(progress_file):
+    progress = {}
     if Path(progress_file).exists():
-        with open(progress_file, "r") as f:
-            return json.load(f)
-    return None
+        with open(progress_file, "rb") as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # Line cut short by an interrupted write
+                chapter = progress.setdefault(
+                    record["chapter"],
+                    {"total_chunks": record["total_chunks"], "chunks": {}},
+                )
+                if chapter["total_chunks"] != record["total_chunks"]:
+                    # The chapter was split differently since; start it over
+                    chapter["total_chunks"] = record["total_chunks"]
+                    chapter["chunks"] = {}
+                # Progress files of earlier versions hold only the index of
+                # the last chunk, not its translation
+                if "text" in record and "source" in record:
+                    chapter["chunks"][record["chunk_index"]] = (
+                        record["source"],
+                        record["text"],
+                    )
+    return progress
+
+
+def model_name(llm):
+    return f"{type(llm).__name__}:{llm.metadata.model_name}"
 
 
-def translate_text(
+def cache_key(model, chunk, from_lang, to_lang, batched=False):
+    # Covers everything the translation depends on: the provider and model,
+    # the full prompt (which names the language pair) and the chunk itself
+    prompt = system_prompt(from_lang, to_lang, batched)
+    return hashlib.sha256(f"{model}|{prompt}|{chunk}".encode()).hexdigest()
+
+
+def save_cache(journal, key, text):
+    # Same append-only layout as the progress file, keyed by chunk hash
+    journal.write(orjson.dumps({"key": key, "text": text}) + b"\n")
+
+
+def load_cache(cache_file):
+    cache = {}
+    if Path(cache_file).exists():
+        with open(cache_file, "rb") as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                    cache[record["key"]] = record["text"]
+                except orjson.JSONDecodeError:
+                    continue  # Line cut short by an interrupted write
+                except (KeyError, TypeError):
+                    continue  # Not a cache record, e.g. from a progress file
+    return cache
+
+
+async def send_batch(
+    llm, from_lang, to_lang, semaphore, translations, in_flight, cache_journal, batch
+):
+    # Translates a batch and hands each chunk's translation (or the error) to
+    # every chapter waiting for it through the chunk's future in in_flight
+    try:
+        async with semaphore:
+            translated, batched = await translate_batch(llm, batch, from_lang, to_lang)
+    except Exception as e:
+        for chunk in batch:
+            future = in_flight.pop(chunk)
+            future.set_exception(e)
+            future.exception()  # Nobody may be waiting; don't log it twice
+        return
+    model = model_name(llm)
+    for chunk, translation in zip(batch, translated):
+        translations[chunk] = translation
+        if cache_journal is not None:
+            key = cache_key(model, chunk, from_lang, to_lang, batched)
+            save_cache(cache_journal, key, translation)
+        in_flight.pop(chunk).set_result(translation)
+
+
+class ChunkBatcher:
+    # Groups small chunks of all chapters into requests of up to max_chunks
+    # chunks and max_chars characters. Only chunks of at most half of
+    # max_chars are batched; the last, partly filled batch is sent once every
+    # chapter has queued its chunks
+    def __init__(self, send, max_chunks=1, max_chars=20000, chapters=1):
+        self.send = send
+        self.max_chunks = max_chunks
+        self.max_chars = max_chars
+        self.chapters = chapters
+        self.batch = []
+        self.batch_chars = 0
+        # The event loop keeps only weak references to running tasks
+        self.tasks = set()
+
+    def add(self, chunk):
+        if self.max_chunks < 2 or len(chunk) * 2 > self.max_chars:
+            self.start([chunk])
+            return
+        if len(self.batch) == self.max_chunks or (
+            self.batch_chars + len(chunk) > self.max_chars
+        ):
+            self.flush()
+        self.batch.append(chunk)
+        self.batch_chars += len(chunk)
+
+    def chapter_queued(self):
+        self.chapters -= 1
+        if self.chapters <= 0:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.start(self.batch)
+        self.batch = []
+        self.batch_chars = 0
+
+    def start(self, batch):
+        task = asyncio.create_task(self.send(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+async def translate_text(
     llm: LLM,
     text: str,
     from_lang: str = "English",
     to_lang: str = "Hungarian",
-    progress_file: Optional[str] = None,
+    progress_journal: Optional[BinaryIO] = None,
     chapter: Optional[int] = None,
+    progress: Optional[dict] = None,
+    translations: Optional[dict] = None,
+    chunk_tokens: Optional[int] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    batcher: Optional[ChunkBatcher] = None,
+    progress_bar: Optional[tqdm] = None,
+    cache_journal: Optional[BinaryIO] = None,
+    cache: Optional[dict] = None,
+    in_flight: Optional[dict] = None,
 ) -> str:
-    translated_chunks = []
-    chunks = split_html_by_sentence(text)
-
-    # Load progress if available
-    start_chunk = 0
-    if progress_file and chapter is not None:
-        progress = load_progress(progress_file)
-        if progress and progress["chapter"] == chapter:
-            start_chunk = progress["chunk_index"]
-            translated_chunks = [
-                ""
-            ] * start_chunk  # Placeholder for already translated chunks
-
-    for i, chunk in enumerate(chunks[start_chunk:], start=start_chunk):
-        print(f"\tTranslating chunk {i + 1}/{len(chunks)}...")
+    # Splitting a long chapter is CPU work; run it in a worker thread so the
+    # event loop keeps handling the responses of other chapters meanwhile
+    if chunk_tokens:
+        chunks = await asyncio.to_thread(
+            split_html_by_sentence, text, chunk_tokens, count_tokens
+        )
+    else:
+        chunks = await asyncio.to_thread(split_html_by_sentence, text)
+    if translations is None:
+        translations = {}
+    if in_flight is None:
+        in_flight = {}
+    # Chunks are independent, so several requests can be in flight at once
+    # instead of waiting for each response before sending the next
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(4)
+    if batcher is None:
+        batcher = ChunkBatcher(
+            functools.partial(
+                send_batch,
+                llm,
+                from_lang,
+                to_lang,
+                semaphore,
+                translations,
+                in_flight,
+                cache_journal,
+            )
+        )
+    if progress_bar is None:
+        progress_bar = tqdm(total=0, disable=True)
+
+    # Reuse chunks finished before an interruption instead of translating
+    # (and paying for) them again, as long as they were translated from the
+    # same text
+    translated_chunks = {}
+    saved = (progress or {}).get(chapter)
+    if saved and saved["total_chunks"] == len(chunks):
+        for i, (source, translation) in saved["chunks"].items():
+            if source == source_hash(chunks[i], from_lang, to_lang):
+                translated_chunks[i] = translation
+    progress_bar.total += len(chunks)
+    progress_bar.update(len(translated_chunks))
+
+    # Identical chunks (front matter, separators, repeated pages) are only
+    # sent to the LLM once per book, so group the remaining ones by text
+    positions = {}
+    for i, chunk in enumerate(chunks):
+        if i not in translated_chunks:
+            positions.setdefault(chunk, []).append(i)
+
+    def finish(chunk):
+        for i in positions[chunk]:
+            translated_chunks[i] = translations[chunk]
+            progress_bar.update()
+
+            if progress_journal is not None and chapter is not None:
+                save_progress(
+                    progress_journal,
+                    chapter,
+                    i,
+                    source_hash(chunk, from_lang, to_lang),
+                    translated_chunks[i],
+                    len(chunks),
+                )
+
+    async def wait_for(chunk, future):
         try:
-            translated_chunk = translate_chunk(llm, chunk, from_lang, to_lang)
-            translated_chunks.append(translated_chunk)
-
-            if progress_file and chapter is not None:
-                save_progress(progress_file, chapter, i + 1, len(chunks))
-
+            await future
         except Exception as e:
-            print(f"Error translating chunk {i + 1}: {str(e)}")
+            logger.error("Error translating chunk %d: %s", positions[chunk][0] + 1, e)
             raise
+        finish(chunk)
+
+    model = model_name(llm)
+    waiting = []
+    for chunk in positions:
+        if chunk not in translations and cache:
+            # A chunk translated alone or as part of a batch is as good either
+            # way
+            for batched in (False, True):
+                key = cache_key(model, chunk, from_lang, to_lang, batched)
+                if key in cache:
+                    translations[chunk] = cache[key]
+                    break
+        if chunk in translations:
+            finish(chunk)
+        elif not has_text(chunk):
+            translations[chunk] = chunk
+            finish(chunk)
+        elif chunk in in_flight:
+            # Another chapter is translating the same chunk right now; wait
+            # for its answer instead of sending a second request
+            waiting.append(wait_for(chunk, in_flight[chunk]))
+        else:
+            in_flight[chunk] = asyncio.get_running_loop().create_future()
+            waiting.append(wait_for(chunk, in_flight[chunk]))
+            batcher.add(chunk)
+    batcher.chapter_queued()
+    await asyncio.gather(*waiting)
 
-    return " ".join(translated_chunks)
+    return " ".join(translated_chunks[i] for i in range(len(chunks)))
+
+
+def chapter_html(content):
+    # The chapter's markup is sent as it is; parsing it only to serialize it
+    # again would cost a full parse per chapter and still change the markup.
+    # EPUB documents are nearly always UTF-8; UnicodeDammit detects the rest
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return UnicodeDammit(content, is_html=True).unicode_markup
 
 
-def translate(
+# Seconds between rewrites of the partial EPUB
+PARTIAL_SAVE_INTERVAL = 60
+
+
+async def translate(
     llm: LLM,
     input_epub_path: str,
     output_epub_path: str,
@@ -158,77 +556,200 @@ def translate(
     from_lang: str = "EN",
     to_lang: str = "HU",
     progress_file: Optional[str] = None,
+    chunk_tokens: Optional[int] = None,
+    max_concurrency: int = 4,
+    batch_max_chunks: int = 1,
+    batch_max_chars: int = 20000,
+    cache_file: Optional[str] = None,
 ):
     book = epub.read_epub(input_epub_path)
+    progress = load_progress(progress_file) if progress_file else {}
+    cache = load_cache(cache_file) if cache_file else {}
+    progress_journal = open_journal(progress_file) if progress_file else None
+    cache_journal = open_journal(cache_file) if cache_file else None
+    translations = {}
+    in_flight = {}
+    # Chapters are translated side by side; one limit for the whole book keeps
+    # the requests in flight at max_concurrency however many chapters run
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    documents = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+    chapters_count = len(documents)
+    unfinished = set()
+    partial_path = Path(f"{output_epub_path}.partial")
+    # Each save rewrites the whole book, so on long books saving after every
+    # chapter adds up; save at most once per PARTIAL_SAVE_INTERVAL instead,
+    # and once more if the run is interrupted
+    unsaved_chapters = 0
+    last_partial_save = time.monotonic()
+
+    def save_partial():
+        nonlocal unsaved_chapters, last_partial_save
+        # Rewritten every time, so it is compressed quickly rather than tightly
+        epub.write_epub(str(partial_path), book, {"compresslevel": 1})
+        unsaved_chapters = 0
+        last_partial_save = time.monotonic()
+
+    async def translate_chapter(item, chapter):
+        nonlocal unsaved_chapters
+        translated_text = await translate_text(
+            llm,
+            chapter_html(item.content),
+            from_lang,
+            to_lang,
+            progress_journal,
+            chapter,
+            progress,
+            translations,
+            chunk_tokens,
+            semaphore,
+            batcher,
+            progress_bar,
+            cache_journal,
+            cache,
+            in_flight,
+        )
+        item.content = translated_text.encode("utf-8")
+        unfinished.discard(chapter)
+        logger.info("Translated chapter %d/%d", chapter, chapters_count)
 
-    current_chapter = 1
-    chapters_count = len(
-        [i for i in book.get_items() if i.get_type() == ebooklib.ITEM_DOCUMENT]
-    )
+        # Save intermediate progress
+        unsaved_chapters += 1
+        if time.monotonic() - last_partial_save >= PARTIAL_SAVE_INTERVAL:
+            save_partial()
 
     try:
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                if from_chapter <= current_chapter <= to_chapter:
-                    print(
-                        "Processing chapter %d/%d..."
-                        % (current_chapter, chapters_count)
-                    )
-                    soup = BeautifulSoup(item.content, "html.parser")
-                    translated_text = translate_text(
-                        llm,
-                        str(soup),
-                        from_lang,
-                        to_lang,
-                        progress_file,
-                        current_chapter,
-                    )
-                    item.content = translated_text.encode("utf-8")
+        chapters = []
+        first = max(from_chapter, 1)
+        # Clamped, so a negative --to-chapter selects no chapters instead of
+        # counting from the end
+        for chapter, item in enumerate(
+            documents[first - 1 : max(to_chapter, 0)], first
+        ):
+            chapters.append(translate_chapter(item, chapter))
+            unfinished.add(chapter)
+
+        # Small chunks of different chapters (title pages, short chapters)
+        # share requests
+        batcher = ChunkBatcher(
+            functools.partial(
+                send_batch,
+                llm,
+                from_lang,
+                to_lang,
+                semaphore,
+                translations,
+                in_flight,
+                cache_journal,
+            ),
+            batch_max_chunks,
+            batch_max_chars,
+            len(chapters),
+        )
 
-                    # Save intermediate progress after each chapter
-                    epub.write_epub(f"{output_epub_path}.partial", book, {})
+        # A progress bar over all chunks instead of a line per chunk; skipped
+        # when stderr, where both the bar and the log go, is not a terminal.
+        # Log messages are printed above the bar instead of breaking it
+        with logging_redirect_tqdm(), tqdm(
+            total=0,
+            unit="chunk",
+            leave=False,
+            disable=not sys.stderr.isatty(),
+        ) as progress_bar:
+            await asyncio.gather(*chapters)
+
+        # ebooklib only reports a failed write through its return value unless
+        # asked to raise
+        epub.write_epub(output_epub_path, book, {"raise_exceptions": True})
+
+        # Clean up the progress file only once the book is safely written
+        if progress_journal is not None:
+            progress_journal.close()
+            Path(progress_file).unlink(missing_ok=True)
+        partial_path.unlink(missing_ok=True)
+
+    # BaseException, so Ctrl-C (which cancels the task with CancelledError)
+    # also gets the catch-up save and the resume hint
+    except BaseException as e:
+        logger.error("Translation interrupted: %s", str(e) or type(e).__name__)
+        if unsaved_chapters:
+            save_partial()
+        if progress_file is not None:
+            logger.info(
+                "Progress saved. Run the same command again with --progress-file %s to resume",
+                progress_file,
+            )
+        # Nothing is left to resume when every chapter finished and only the
+        # final write failed
+        elif unfinished:
+            first_unfinished = min(unfinished)
+            logger.info(
+                "You can resume from chapter %d using --from-chapter %d",
+                first_unfinished,
+                first_unfinished,
+            )
+        # Keep the progress file and partial epub in case of error
+        raise
 
-                current_chapter += 1
+    finally:
+        for journal in (progress_journal, cache_journal):
+            if journal is not None:
+                journal.close()
 
-        # Clean up progress file and write final epub
-        if progress_file is not None and Path(progress_file).exists():
-            Path(progress_file).unlink()
-        if Path(f"{output_epub_path}.partial").exists():
-            Path(f"{output_epub_path}.partial").unlink()
 
-        epub.write_epub(output_epub_path, book, {})
+BLANK_LINES = re.compile(r"\n{2,}")
 
-    except Exception as e:
-        print(f"Translation interrupted: {str(e)}")
-        print(
-            f"Progress saved. You can resume from chapter {current_chapter} using --from-chapter {current_chapter}"
-        )
-        # Keep the progress file and partial epub in case of error
-        raise
+
+class TextBeginning:
+    # lxml parser target that keeps the first `length` characters of text,
+    # skipping script and style contents, without building a tree
+    def __init__(self, length):
+        self.length = length
+        self.parts = []
+        self.collected = 0
+        self.skipping = False
+
+    def start(self, tag, attrib):
+        self.skipping = tag in ("script", "style")
+
+    def end(self, tag):
+        self.skipping = False
+
+    def data(self, text):
+        if text.isspace():
+            # Indentation between tags only adds noise to the preview
+            text = "\n"
+        if not self.skipping and self.collected < self.length:
+            self.parts.append(text)
+            self.collected += len(text)
+
+    def close(self):
+        return "".join(self.parts)[: self.length]
+
+
+def text_beginning(content, length):
+    # Decode the same way translation does, so chapters declared in another
+    # encoding are previewed correctly. Fed as a string, because
+    # fromstring() rejects strings that carry an XML encoding declaration
+    parser = etree.HTMLParser(target=TextBeginning(length))
+    parser.feed(chapter_html(content))
+    return parser.close()
 
 
 def show_chapters(input_epub_path):
     book = epub.read_epub(input_epub_path)
 
     total_characters = 0
-    current_chapter = 1
-    chapters_count = len(
-        [i for i in book.get_items() if i.get_type() == ebooklib.ITEM_DOCUMENT]
-    )
+    documents = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+    chapters_count = len(documents)
 
-    for item in book.get_items():
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            chapter_length = len(item.content)
-            total_characters += chapter_length
-            print(
-                f"▶️  Chapter {current_chapter}/{chapters_count} ({chapter_length} characters)"
-            )
-            soup = BeautifulSoup(item.content, "html.parser")
-            chapter_beginning = soup.text[0:250]
-            chapter_beginning = re.sub(r"\n{2,}", "\n", chapter_beginning)
-            print(chapter_beginning + "\n\n")
-
-            current_chapter += 1
+    for chapter, item in enumerate(documents, 1):
+        chapter_length = len(item.content)
+        total_characters += chapter_length
+        print(f"▶️  Chapter {chapter}/{chapters_count} ({chapter_length} characters)")
+        chapter_beginning = text_beginning(item.content, 250)
+        chapter_beginning = BLANK_LINES.sub("\n", chapter_beginning)
+        print(chapter_beginning + "\n\n")
 
     print(f"Total characters in the book: {total_characters}")
 
@@ -236,11 +757,16 @@ def show_chapters(input_epub_path):
 def initialize_llm_client(provider: str, config: dict) -> LLM:
     """
     Initialize the LLM client based on the provider.
+
+    Provider SDKs are imported here rather than at module level, so only the
+    chosen one is loaded and show-chapters loads none of them.
     """
     if provider == "openai":
+        from llama_index.llms.openai import OpenAI
+
         api_key = config["openai"]["api_key"]
         model = config["openai"].get("model", "gpt-4o")
-        print(f"Initializing OpenAI with model: {model}")
+        logger.info("Initializing OpenAI with model: %s", model)
         return OpenAI(
             api_key=api_key,
             model=model,
@@ -248,11 +774,13 @@ def initialize_llm_client(provider: str, config: dict) -> LLM:
         )
 
     elif provider == "azure":
+        from llama_index.llms.azure_openai import AzureOpenAI
+
         api_key = config["azure"]["api_key"]
         azure_endpoint = config["azure"]["endpoint"]
         api_version = config["azure"].get("api_version", "2024-02-01")
         deployment_name = config["azure"]["deployment_name"]
-        print(f"Initializing Azure OpenAI with deployment: {deployment_name}")
+        logger.info("Initializing Azure OpenAI with deployment: %s", deployment_name)
         return AzureOpenAI(
             api_key=api_key,
             azure_endpoint=azure_endpoint,
@@ -262,9 +790,11 @@ def initialize_llm_client(provider: str, config: dict) -> LLM:
         )
 
     elif provider == "gemini":
+        from llama_index.llms.gemini import Gemini
+
         api_key = config["gemini"]["api_key"]
         model = config["gemini"].get("model", "gemini-1.5-flash")
-        print(f"Initializing Gemini with model: {model}")
+        logger.info("Initializing Gemini with model: %s", model)
         return Gemini(
             api_key=api_key,
             model=model,
@@ -272,9 +802,11 @@ def initialize_llm_client(provider: str, config: dict) -> LLM:
         )
 
     elif provider == "ollama":
+        from llama_index.llms.ollama import Ollama
+
         model = config["ollama"].get("model", "llama3.1")
         base_url = config["ollama"].get("base_url", "http://localhost:11434")
-        print(f"Initializing Ollama with model: {model} at {base_url}")
+        logger.info("Initializing Ollama with model: %s at %s", model, base_url)
         return Ollama(
             model=model,
             base_url=base_url,
@@ -310,6 +842,33 @@ if __name__ == "__main__":
     parser_translate.add_argument(
         "--progress-file", help="File to save translation progress."
     )
+    parser_translate.add_argument(
+        "--chunk-tokens",
+        type=int,
+        help="Maximum chunk size in tokens (default: 20000 characters).",
+    )
+    parser_translate.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of requests sent to the LLM at the same time.",
+    )
+    parser_translate.add_argument(
+        "--batch-max-chunks",
+        type=int,
+        default=1,
+        help="Maximum number of small chunks sent in one request.",
+    )
+    parser_translate.add_argument(
+        "--batch-max-chars",
+        type=int,
+        default=20000,
+        help="Maximum combined size in characters of a batch of chunks.",
+    )
+    parser_translate.add_argument(
+        "--cache-file",
+        help="File of translated chunks, reused across runs and books.",
+    )
     parser_translate.add_argument(
         "--llm-provider",
         choices=["openai", "azure", "gemini", "ollama"],
@@ -328,6 +887,10 @@ if __name__ == "__main__":
 
     # Call the appropriate function based on the mode
     if args.mode == "translate":
+        # Only this script's messages at INFO; libraries such as httpx log a
+        # line per request there, which would bury the progress
+        logging.basicConfig(format="%(message)s")
+        logger.setLevel(logging.INFO)
         config = read_config(args.config)
         from_chapter = int(args.from_chapter or 0)
         to_chapter = int(args.to_chapter or 9999)
@@ -337,15 +900,22 @@ if __name__ == "__main__":
         llm_client = initialize_llm_client(args.llm_provider, config)
 
         # Perform translation
-        translate(
-            llm_client,
-            args.input,
-            args.output,
-            from_chapter,
-            to_chapter,
-            from_lang,
-            to_lang,
-            args.progress_file,
+        asyncio.run(
+            translate(
+                llm_client,
+                args.input,
+                args.output,
+                from_chapter,
+                to_chapter,
+                from_lang,
+                to_lang,
+                args.progress_file,
+                args.chunk_tokens,
+                args.max_concurrency,
+                args.batch_max_chunks,
+                args.batch_max_chars,
+                args.cache_file,
+            )
         )
 
     elif args.mode == "show-chapters":